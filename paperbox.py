@@ -39,34 +39,303 @@ Python 3
 
 # ----------------------------- logging --------------------------
 import logging
-from sys import stdout
+from sys import argv as sys_argv, stdout
 from datetime import datetime
 
 
 # ----------------------------- #### --------------------------
-from docopt import docopt
-
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import cm
+from functools import lru_cache
+from itertools import accumulate
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, Iterable, Optional
+
+# reportlab and docopt are imported where they are used, keeping imports cheap
+if TYPE_CHECKING:
+    from reportlab.pdfgen.canvas import Canvas
+
+VERSION = "1.1"
+
+# verbose level from the command line, see --verbose
+_LEVELS = {
+    "1": logging.DEBUG,
+    "2": logging.INFO,
+    "3": logging.WARN,
+    "4": logging.ERROR,
+    "5": logging.CRITICAL,
+}
+
+# conversion from points to cm
+_PT_TO_CM = 1 / 28.35
 
 make_long_mid_faces = True
 ALLOW_WARPING = True
 
 
+# ----------------------------- #### --------------------------
+# fixed objects of the single page pdf written by ``_write_pdf``
+_PDF_HEADER = b"%PDF-1.4\n"
+_PDF_OBJECTS = (
+    b"1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n",
+    b"2 0 obj\n<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n",
+    b"3 0 obj\n<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.4f %.4f] "
+    b"/Contents 4 0 R /Resources << >> >>\nendobj\n",
+    b"4 0 obj\n<< /Length %d >>\nstream\n%b\nendstream\nendobj\n",
+)
+_PDF_TRAILER = b"trailer\n<< /Size 5 /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+_PDF_RECT = b"%.4f %.4f %.4f %.4f re\n"
+_PDF_MOVE = b"%.4f %.4f m\n"
+_PDF_LINE = b"%.4f %.4f l\n"
+
+
+# (dash, rects, polylines) stroked together, see ``_write_pdf``
+_Group = tuple[
+    tuple[int, ...],
+    Iterable[tuple[float, float, float, float]],
+    Iterable[tuple[tuple[float, float], ...]],
+]
+
+
+def _polyline(points: tuple[tuple[float, float], ...]) -> bytes:
+    """Path operators for the polyline through ``points``, closed with ``h`` when the
+    last point is the first one.
+    """
+    closed = points[-1] == points[0]
+    ops = [_PDF_MOVE % points[0]]
+    ops += [_PDF_LINE % p for p in points[1 : -1 if closed else None]]
+    if closed:
+        ops.append(b"h\n")
+    return b"".join(ops)
+
+
+def _write_pdf(
+    fh: BinaryIO,
+    pagesize: tuple[float, float],
+    groups: Iterable[_Group],
+) -> None:
+    """Write a single page pdf stroking the rectangles and lines, without a canvas.
+    The page only holds path and ``S`` operators, so the content stream is formatted
+    directly and the file is assembled from the fixed objects in one write.
+
+    ## Parameters
+    ``fh``: binary file handle to write to.
+    ``pagesize``: size of the page in points.
+    ``groups``: ``(dash, rects, lines)`` triples, ``dash`` is the dash array, e.g.
+    ``(4, 1)`` or ``()`` for solid, ``rects`` the ``(x, y, width, height)`` rectangles
+    to stroke and ``lines`` polylines as tuples of points, closed when the last point
+    is the first.
+
+    ## Return
+    None
+    """
+    content = b"".join(
+        b"[%b] 0 d\n%b%bS\n"
+        % (
+            b" ".join([b"%d" % d for d in dash]),
+            b"".join([_PDF_RECT % r for r in rects]),
+            b"".join([_polyline(points) for points in lines]),
+        )
+        for dash, rects, lines in groups
+    )
+    objects = (
+        _PDF_OBJECTS[0],
+        _PDF_OBJECTS[1],
+        _PDF_OBJECTS[2] % pagesize,
+        _PDF_OBJECTS[3] % (len(content), content),
+    )
+
+    offset = len(_PDF_HEADER)
+    xref = [b"xref\n0 5\n0000000000 65535 f \n"]
+    for obj in objects:
+        xref.append(b"%010d 00000 n \n" % offset)
+        offset += len(obj)
+
+    fh.write(b"".join((_PDF_HEADER, *objects, *xref, _PDF_TRAILER % offset)))
+
+
+def _draw_on_canvas(c: "Canvas", groups: Iterable[_Group]) -> None:
+    """Stroke the same groups as ``_write_pdf`` on the current page of a ReportLab
+    canvas, one path object per dash style.
+    """
+    for dash, rects, lines in groups:
+        p = c.beginPath()
+        for x, y, width, height in rects:
+            p.rect(x, y, width, height)
+        for points in lines:
+            closed = points[-1] == points[0]
+            p.moveTo(*points[0])
+            for point in points[1 : -1 if closed else None]:
+                p.lineTo(*point)
+            if closed:
+                p.close()
+        c.setDash(list(dash))
+        c.drawPath(p, stroke=1, fill=0)
+    c.setDash([])
+
+
+# ----------------------------- #### --------------------------
+def _validate(l: float, w: float, h: float, pagesize: tuple[float, float]) -> None:
+    """Check that the box dimensions, in cm and ordered, fit in the page.
+
+    ## Parameters
+    ``l``, ``w``, ``h``: dimensions of the box with l >= w >= h.
+    ``pagesize``: size of the page in points.
+
+    ## Return
+    None, raises ``ValueError`` when the box can not be drawn.
+    """
+    if not l >= w >= h > 0:
+        raise ValueError("Dimmesion/s can not be zero.")
+
+    L_PAGE = pagesize[1] * _PT_TO_CM  # conversion to cm
+    W_PAGE = pagesize[0] * _PT_TO_CM
+
+    L_MAX = l * 2 + 3 * h
+    if L_MAX >= L_PAGE:
+        if not ALLOW_WARPING:
+            raise ValueError(
+                f"Too big length or height. Occupied space can not be more than {L_PAGE:.2f} cm. Current is {L_MAX:.2f} cm."
+            )
+        logging.warning("Length is too big %.2f with maximum of %.2f. ", L_MAX, L_PAGE)
+
+    W_MAX = w + 2 * h
+    logging.debug("Width is %.2f and %.2f.", W_MAX, W_PAGE)
+    if W_MAX > W_PAGE:
+        raise ValueError(
+            f"Too big width or height. Occupied space can not be more than {W_PAGE:.2f} cm. Current is {W_MAX:.2f} cm."
+        )
+
+
+# ----------------------------- #### --------------------------
+@lru_cache(maxsize=128)
+def _box_geometry(
+    l: float,
+    w: float,
+    h: float,
+    w_mid: float,
+    gap: float,
+    cut_gap: float,
+    x_offset: float,
+    y_offset: float,
+) -> tuple[_Group, ...]:
+    """Coordinates in points of everything stroked for a box, only arithmetic, so
+    boxes with the same dimensions reuse the result.
+
+    ## Parameters
+    ``l``, ``w``, ``h``: dimensions of the box in cm with l >= w >= h, already
+    enlarged by the gaps.
+    ``w_mid``: width of the mid faces in cm.
+    ``gap``, ``cut_gap``, ``x_offset``, ``y_offset``: as in ``generate_paper_box``.
+
+    ## Return
+    ``(dash, rects, lines)`` groups for ``_write_pdf`` and ``_draw_on_canvas``.
+    """
+    from reportlab.lib.units import cm
+
+    # precomputed lengths in points
+    w_cm = w * cm
+    h_cm = h * cm
+    l_cm = l * cm
+    wmid_cm = w_mid * cm
+    cut_cm = cut_gap * cm
+    x_off = x_offset * cm
+    y_off = y_offset * cm
+
+    # rectangles (x, y, width, height) grouped by dash style:
+    # folds (solid), covers (4, 1) and glue tabs (1, 2)
+    solid = []
+    covers = []
+    tabs = []
+    solid_rect = solid.append
+    cover_rect = covers.append
+    tab_rect = tabs.append
+    # solid polylines as point tuples, closed when the last point is the first one
+    lines = []
+    solid_line = lines.append
+
+    # x anchors of the left side, main column and right side, the right mid face also
+    # starts at x_right and the left one at the margin x_off
+    x_left = x_off + wmid_cm - h_cm
+    x_main = x_off + wmid_cm
+    x_right = x_main + w_cm
+
+    # main faces
+    # face heights of the main column from bottom to top, ys are their running bottoms
+    heights = (h_cm, l_cm, h_cm, l_cm)
+    ys = tuple(accumulate(heights, initial=y_off))
+    y_bottom, y_side, y_side_top, y_fold, y_top = ys
+
+    # silhouette of the main column with the left and right sides attached
+    start = (x_main, y_bottom)
+    solid_line(
+        (
+            start,
+            (x_right, y_bottom),
+            (x_right, y_side),
+            (x_right + h_cm, y_side),
+            (x_right + h_cm, y_side_top),
+            (x_right, y_side_top),
+            (x_right, y_top),
+            (x_main, y_top),
+            (x_main, y_side_top),
+            (x_left, y_side_top),
+            (x_left, y_side),
+            (x_main, y_side),
+            start,
+        )
+    )
+    # folds inside the silhouette, each shared edge is stroked once
+    for y in (y_side, y_side_top, y_fold):
+        solid_line(((x_main, y), (x_right, y)))
+    solid_line(((x_main, y_side), (x_main, y_side_top)))
+    solid_line(((x_right, y_side), (x_right, y_side_top)))
+
+    # with gaps, each face gets its inner face inset by the gap, without gaps
+    # (gap == 0) nothing below depends on the gap
+    if gap > 0:
+        gap_cm = gap * cm
+        wi_cm = w_cm - 2 * gap_cm
+        for y, face_h in zip(ys, heights):
+            solid_rect((x_main + gap_cm, y + gap_cm, wi_cm, face_h - 2 * gap_cm))
+
+    # cover
+    cover_rect((x_main + cut_cm, y_top, w_cm - 2 * cut_cm, h_cm - cut_cm))
+
+    # ### ------- sides
+    # side tabs, the sides themselves are part of the silhouette
+    tab_rect((x_left + cut_cm, y_off + cut_cm, h_cm - 2 * cut_cm, h_cm - cut_cm))
+    tab_rect((x_right + cut_cm, y_off + cut_cm, h_cm - 2 * cut_cm, h_cm - cut_cm))
+
+    # up side faces
+    cover_rect((x_right, y_fold + cut_cm, h_cm - cut_cm, l_cm - 2 * cut_cm))
+    cover_rect((x_left + cut_cm, y_fold + cut_cm, h_cm - cut_cm, l_cm - 2 * cut_cm))
+
+    # mid faces
+    tab_rect((x_off + cut_cm, y_side_top + cut_cm, wmid_cm - cut_cm, h_cm - 2 * cut_cm))
+    tab_rect((x_right, y_side_top + cut_cm, wmid_cm - cut_cm, h_cm - 2 * cut_cm))
+
+    return (
+        ((), tuple(solid), tuple(lines)),
+        ((4, 1), tuple(covers), ()),
+        ((1, 2), tuple(tabs), ()),
+    )
+
+
 # ----------------------------- #### --------------------------
 def generate_paper_box(
     l: float,
     w: float,
     h: float,
     *,
-    pagesize: tuple[float, float] = A4,
+    pagesize: Optional[tuple[float, float]] = None,
     output_folder=".//",
     output_name="paper_box.pdf",
     gap=0.075,
     cut_gap=0.25,
     x_offset=0.5,
     y_offset=0.5,
+    canvas_obj: Optional["Canvas"] = None,
+    finalize=True,
 ) -> None:
     """Generate a pdf with the lines to create a paper box with the given dimensions.
     It reorders the dimensions to be l >= w >= h.
@@ -82,15 +351,34 @@ def generate_paper_box(
     ``cut_gap``: gap between main faces and cut faces. Default is 0.5 cm.
     ``x_offset``: margin for x. Default is 0.5 cm.
     ``y_offset``: margin for y. Default is 0.5 cm.
+    ``canvas_obj``: ReportLab canvas to draw the box on instead of writing a new pdf,
+    e.g. to put several boxes in one file. ``output_folder`` and ``output_name`` are
+    then not used. Default is None.
+    ``finalize``: with ``canvas_obj``, save the canvas after drawing the box. When
+    False the page is closed with ``showPage`` so the next box goes on a new page.
+    Default is True.
 
     ## Return
     None
     """
+    from reportlab.lib.pagesizes import A4
+
+    if pagesize is None:
+        pagesize = A4
 
     # Reorder the dimensions
-    l, w, h = sorted([l, w, h], reverse=True)
+    # three compare-and-swaps, without building a list
+    if l < w:
+        l, w = w, l
+    if w < h:
+        w, h = h, w
+    if l < w:
+        l, w = w, l
     logging.debug(
-        f"Generating paper box with dimensions: {l} length, {w} width, {h} height."
+        "Generating paper box with dimensions: %s length, %s width, %s height.",
+        l,
+        w,
+        h,
     )
 
     # --- gapping condition
@@ -102,27 +390,8 @@ def generate_paper_box(
         h += 2 * gap
 
     # --- checking
-    L_PAGE = pagesize[1] / 28.35  # conversion to cm
-    W_PAGE = pagesize[0] / 28.35
-
-    assert l >= w >= h > 0, "Dimmesion/s can not be zero."
-    L_MAX = l * 2 + 3 * h
-
-    if ALLOW_WARPING:
-        if L_MAX >= L_PAGE:
-            logging.warning(
-                f"Length is too big {L_MAX:.2f} with maximum of {L_PAGE:.2f}. "
-            )
-    else:
-        assert (
-            L_MAX < L_PAGE
-        ), f"Too big length or height. Occupied space can not be more than {L_PAGE:.2f} cm. Current is {L_MAX:.2f} cm."
-
-    W_MAX = w + 2 * h
-    logging.debug(f"Width is {W_MAX:.2f} and {W_PAGE:.2f}.")
-    assert (
-        W_MAX <= W_PAGE
-    ), f"Too big width or height. Occupied space can not be more than {W_PAGE:.2f} cm. Current is {W_MAX:.2f} cm."
+    _validate(l, w, h, pagesize)
+    W_PAGE = pagesize[0] * _PT_TO_CM
 
     # -- mid squares
     if make_long_mid_faces:
@@ -132,151 +401,90 @@ def generate_paper_box(
         w_mid = W_WIDE_MAX / 2
         if l > w_mid:
             logging.warning(
-                f"Width of the mid faces is too big {W_WIDE:.2f} and {W_WIDE_MAX:.2f}. It will be reduced from {l:.2f} to {w_mid:.2f}."
+                "Width of the mid faces is too big %.2f and %.2f. It will be reduced from %.2f to %.2f.",
+                W_WIDE,
+                W_WIDE_MAX,
+                l,
+                w_mid,
             )
         else:
             w_mid = l
 
     # --- drawing
-    full_file_path = output_folder + output_name
-    logging.info(f"Generating paper box in {full_file_path}.")
-    c = canvas.Canvas(full_file_path, pagesize=A4)
-
-    # main faces
-    logging.debug("Drawing main faces.")
-    x0 = (x_offset + w_mid) * cm
-    y0 = y_offset * cm
-
-    c.rect(x0, y0, w * cm, h * cm)
-    y0 += h * cm
-    c.rect(x0, y0, w * cm, l * cm)
-    y0 += l * cm
-    c.rect(x0, y0, w * cm, h * cm)
-    y0 += h * cm
-    c.rect(x0, y0, w * cm, l * cm)
-    y0 += l * cm
-
-    # cover
-    c.setDash(4, 1)
-    c.rect(x0 + cut_gap * cm, y0, (w - 2 * cut_gap) * cm, (h - cut_gap) * cm)
-    c.setDash([])
-
-    # ### ------- sides
-    logging.debug("Drawing sides.")
-    x0 = (x_offset + w_mid - h) * cm
-    y0 = y_offset * cm
-
-    c.setDash(1, 2)
-    c.rect(
-        x0 + cut_gap * cm,
-        y0 + cut_gap * cm,
-        (h - 2 * cut_gap) * cm,
-        (h - cut_gap) * cm,
-    )
-    c.setDash([])
+    logging.debug("Drawing main faces, sides and mid faces.")
+    groups = _box_geometry(l, w, h, w_mid, gap, cut_gap, x_offset, y_offset)
+
+    # --- shared canvas, one page per box
+    if canvas_obj is not None:
+        _draw_on_canvas(canvas_obj, groups)
+        if finalize:
+            logging.info("Saving pdf.")
+            canvas_obj.save()
+        else:
+            canvas_obj.showPage()
+        return
 
-    # left side
-    c.rect(x0, y0 + h * cm, h * cm, l * cm)
+    # --- writing, the whole pdf goes through a 64 KiB buffered handle in one write
+    full_file_path = os.fspath(Path(output_folder) / output_name)
+    logging.info("Generating paper box in %s.", full_file_path)
+    logging.info("Saving pdf.")
+    with open(full_file_path, "wb", buffering=1 << 16) as fh:
+        _write_pdf(fh, A4, groups)
+    return
 
-    x0 += (w + h) * cm
 
-    c.setDash(1, 2)
-    c.rect(
-        x0 + cut_gap * cm,
-        y0 + cut_gap * cm,
-        (h - 2 * cut_gap) * cm,
-        (h - cut_gap) * cm,
-    )
-    c.setDash([])
-
-    # right side
-    c.rect(x0, y0 + h * cm, h * cm, l * cm)
+# ----------------------------- #### --------------------------
+@lru_cache(maxsize=1)
+def _usage_pattern() -> tuple:
+    """Parse the usage in ``__doc__`` once, ``docopt`` parses it again on every call.
 
-    # up side faces
-    y0 += (l + h * 2) * cm
+    ## Return
+    ``(usage, options, pattern)`` as built by ``docopt``.
+    """
+    from docopt import formal_usage, parse_defaults, parse_pattern, printable_usage
 
-    c.setDash(4, 1)
-    # up right face
-    c.rect(x0, y0 + cut_gap * cm, (h - cut_gap) * cm, (l - 2 * cut_gap) * cm)
-    x0 -= (w + h) * cm
+    usage = printable_usage(__doc__)
+    options = parse_defaults(__doc__)
+    pattern = parse_pattern(formal_usage(usage), options).fix()
+    return usage, options, pattern
 
-    # up left face
-    c.rect(
-        x0 + cut_gap * cm, y0 + cut_gap * cm, (h - cut_gap) * cm, (l - 2 * cut_gap) * cm
-    )
-    c.setDash([])
 
-    # mid faces
-    c.setDash(1, 2)
-    logging.debug("Drawing mid faces.")
-    x0 = x_offset * cm
-    y0 = (y_offset + h + l) * cm
-
-    # left side
-    c.rect(
-        x0 + cut_gap * cm,
-        y0 + cut_gap * cm,
-        (w_mid - cut_gap) * cm,
-        (h - 2 * cut_gap) * cm,
-    )
+def parse_args(argv: Optional[list[str]] = None) -> dict:
+    """Same as ``docopt(__doc__, argv, version=VERSION)`` but reusing the parsed usage.
 
-    x0 = (x_offset + w_mid + w) * cm
-    y0 = (y_offset + h + l) * cm
+    ## Parameters
+    ``argv``: command line arguments. Default is ``sys.argv[1:]``.
 
-    # right side
-    c.rect(
-        x0,
-        y0 + cut_gap * cm,
-        (w_mid - cut_gap) * cm,
-        (h - 2 * cut_gap) * cm,
-    )
-    c.setDash([])
+    ## Return
+    Dictionary with the parsed arguments.
+    """
+    from docopt import Dict, DocoptExit, TokenStream, extras, parse_argv
 
-    # ----- GAPPING
-    if not GAPPING:
-        logging.info("Saving pdf.")
-        c.save()
-        return
+    if argv is None:
+        argv = sys_argv[1:]
+    usage, options, pattern = _usage_pattern()
+    DocoptExit.usage = usage
+    argv = parse_argv(TokenStream(argv, DocoptExit), list(options), False)
+    extras(True, VERSION, argv, __doc__)
+    matched, left, collected = pattern.match(argv)
+    if matched and left == []:
+        return Dict((a.name, a.value) for a in (pattern.flat() + collected))
+    raise DocoptExit()
 
-    # ----- GAPPING
-    # Executes everything again but with gaps
-    logging.debug("Drawing main faces with gaps.")
-    l -= 2 * gap
-    w -= 2 * gap
-    h -= 2 * gap
-    x0 = (x_offset + w_mid + gap) * cm
-    y0 = (y_offset + gap) * cm
-
-    c.rect(x0, y0, w * cm, h * cm)
-    y0 += (h + 2 * gap) * cm
-    c.rect(x0, y0, w * cm, l * cm)
-    y0 += (l + 2 * gap) * cm
-    c.rect(x0, y0, w * cm, h * cm)
-    y0 += (h + 2 * gap) * cm
-    c.rect(x0, y0, w * cm, l * cm)
 
-    logging.info("Saving pdf.")
-    c.save()
-    return
+def main(argv: Optional[list[str]] = None) -> None:
+    """Command line entry point, see the usage in ``__doc__``.
 
+    ## Parameters
+    ``argv``: command line arguments. Default is ``sys.argv[1:]``.
 
-if __name__ == "__main__":
-    args = docopt(
-        doc=__doc__,
-        version="1.1",
-    )
+    ## Return
+    None
+    """
+    args = parse_args(argv)
 
     print(args)
-    if args["--verbose"] == "1":
-        _level = logging.DEBUG
-    elif args["--verbose"] == "2":
-        _level = logging.INFO
-    elif args["--verbose"] == "3":
-        _level = logging.WARN
-    elif args["--verbose"] == "4":
-        _level = logging.ERROR
-    elif args["--verbose"] == "5":
-        _level = logging.CRITICAL
+    _level = _LEVELS.get(args["--verbose"], logging.INFO)
 
     logging.basicConfig(
         level=_level,
@@ -284,7 +492,7 @@ if __name__ == "__main__":
         stream=stdout,
         datefmt="%m-%d %H:%M:%S",
     )
-    logging.debug(f"Started at {datetime.now()}")
+    logging.debug("Started at %s", datetime.now())
 
     l = float(args["<length>"])
     w = float(args["<width>"])
@@ -303,3 +511,7 @@ if __name__ == "__main__":
         x_offset=float(args["--m"]),
         y_offset=float(args["--m"]),
     )
+
+
+if __name__ == "__main__":
+    main()